@@ -2,29 +2,282 @@ from fastapi import HTTPException
 import speech_recognition as sr
 import ezdxf
 import json
+import numpy as np
 from pydub import AudioSegment
-from pydub.silence import split_on_silence
-from typing import Dict, Any, Union, Optional
+from typing import Dict, Any, Union, Optional, List, Tuple
+from pydantic import BaseModel, Field
 import re
 import os
 import google.generativeai as genai
-import uuid
+from google.api_core import exceptions as google_exceptions
+import itertools
+import functools
+from types import MappingProxyType
 import io
 import time
+import zlib
+import threading
+import asyncio
+import hashlib
+import secrets
+import copy
+import atexit
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from file_cache import InMemoryFileCache
+from file_cache import InMemoryFileCache, SegmentedFileCache
+
+try:
+    import soundfile as sf
+except ImportError:  # optional: without it every non-WAV upload is decoded by pydub/ffmpeg
+    sf = None
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash')
+GEMINI_MODEL = 'gemini-1.5-flash'
+
+_model = None
+
+
+def _configure_genai():
+    # flag lives on the genai module so importing this file twice (e.g. as `dwg_processor` and
+    # `backend.dwg_processor`) still configures the SDK only once
+    if not getattr(genai, '_configured', False):
+        genai.configure(api_key=GEMINI_API_KEY)
+        genai._configured = True
+
+
+def get_model():
+    """Shared Gemini model handle, configured and constructed on first use."""
+    global _model
+    if _model is None:
+        _configure_genai()
+        _model = genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
+
+# Structured-output schema for Gemini; replaces the example JSON that used to be spelled out in the prompt
+class ElementSize(BaseModel):
+    width: float
+    height: float
+
+
+class DrawingElement(BaseModel):
+    type: str = Field(description="door/window/wall/fixture")
+    position: str = Field(description="north/south/east/west/front/back/left/right")
+    size: ElementSize
+
+
+class Dimensions(BaseModel):
+    length: float
+    width: float
+    unit: str = Field(description="feet/meters")
+
+
+class DrawingParams(BaseModel):
+    room_type: str = Field(description="kitchen/bedroom/living_room/office/bathroom")
+    dimensions: Dimensions
+    elements: List[DrawingElement]
+    additional_notes: str = Field(description="any other specifications")
+
+
+# Static part of the extraction prompt; the transcript is appended after it on every call.
+EXTRACTION_INSTRUCTIONS = (
+    "Extract room drawing parameters from the transcript. "
+    "If dimensions or positions aren't specified, use reasonable defaults for the room type."
+)
+
+# JSON mode constrained to DrawingParams: the reply is always a bare JSON document
+GENERATION_CONFIG = {'response_mime_type': 'application/json', 'response_schema': DrawingParams}
+
+# Bound Gemini latency: per-attempt timeout (seconds) and attempts before the regex fallback.
+# Only transient errors are retried, with exponential backoff (0.2 s, 0.4 s, ...).
+GEMINI_TIMEOUT = 5.0
+GEMINI_ATTEMPTS = 2
+_RETRYABLE_GEMINI_ERRORS = (google_exceptions.DeadlineExceeded, google_exceptions.ServiceUnavailable)
+
+# audio shorter than this (ms) is sent to the speech API in one request instead of silence-split chunks
+SHORT_AUDIO_MS = 30_000
+
+# fallback extractor patterns, compiled once
+_DIM_RE = re.compile(r'(\d+)x(\d+)')
+_NUM_RE = re.compile(r'-?\d+(?:\.\d+)?')
+_ROOM_TYPES = ('kitchen', 'bedroom', 'living room', 'office', 'bathroom')  # in priority order
+_KEYWORD_RE = re.compile('|'.join(_ROOM_TYPES + ('door', 'window', 'left', 'right', 'front', 'back')))
+
+# Element geometry, table-driven. Positions normalize to a wall side; each geometry entry takes the room
+# length L and width W plus the element's span along its wall (a0 = start, a1 = end, am = middle) and
+# returns the lines to draw, an optional door swing arc (center, start_angle, end_angle) and the label insert.
+_POS_ALIAS = {
+    'north': 'N', 'front': 'N',
+    'south': 'S', 'back': 'S',
+    'east': 'E', 'right': 'E',
+    'west': 'W', 'left': 'W',
+}
+_DOOR_GEOM = {
+    'E': lambda L, W, a0, a1, am: {'lines': [((L, a0), (L, a1))], 'arc': ((L, a0), 180, 270), 'text': (L - 1, am)},
+    'W': lambda L, W, a0, a1, am: {'lines': [((0, a0), (0, a1))], 'arc': ((0, a1), 0, 90), 'text': (1, am)},
+    'N': lambda L, W, a0, a1, am: {'lines': [((a0, W), (a1, W))], 'arc': ((a0, W), 270, 360), 'text': (am, W - 1)},
+    'S': lambda L, W, a0, a1, am: {'lines': [((a0, 0), (a1, 0))], 'arc': ((a1, 0), 90, 180), 'text': (am, 1)},
+}
+_WINDOW_GEOM = {
+    'N': lambda L, W, a0, a1, am: {'lines': [((a0, W), (a1, W)), ((a0, W - 0.2), (a1, W - 0.2))], 'text': (am, W - 0.5)},
+    'S': lambda L, W, a0, a1, am: {'lines': [((a0, 0), (a1, 0)), ((a0, 0.2), (a1, 0.2))], 'text': (am, 0.5)},
+    'E': lambda L, W, a0, a1, am: {'lines': [((L, a0), (L, a1)), ((L - 0.2, a0), (L - 0.2, a1))],
+                                   'text': (L - 0.5, am), 'rotation': 90},
+    'W': lambda L, W, a0, a1, am: {'lines': [((0, a0), (0, a1)), ((0.2, a0), (0.2, a1))],
+                                   'text': (0.5, am), 'rotation': 90},
+}
+# element type -> (label, text height, side for unrecognised positions, geometry table)
+# doors with an unknown position go on the south wall; windows with one are skipped
+_ELEMENT_STYLES = {
+    'door': ("DOOR", 0.5, 'S', _DOOR_GEOM),
+    'window': ("WINDOW", 0.3, None, _WINDOW_GEOM),
+}
+
+
+def _decode_soundfile(bio) -> Optional[tuple]:
+    """
+    Decode audio in-process with libsndfile (FLAC, OGG, MP3 with libsndfile >= 1.1, ...).
+    Returns (mono int16 samples, sample rate), or None if soundfile isn't installed or can't read
+    the format, in which case the caller falls back to pydub/ffmpeg.
+    """
+    if sf is None:
+        return None
+    try:
+        data, frame_rate = sf.read(bio, dtype='int16', always_2d=True)
+    except Exception:
+        return None
+    if data.shape[1] == 1:
+        return data.reshape(-1), frame_rate
+    return data.mean(axis=1).astype(np.int16), frame_rate
+
+
+def _detect_nonsilent(samples: np.ndarray, frame_rate: int, channels: int, max_amplitude: float,
+                      min_silence_len: int = 500, silence_thresh: float = -40, frame_len: int = 10):
+    """
+    Vectorized stand-in for pydub.silence.detect_nonsilent.
+    Computes RMS over frame_len ms frames in one NumPy pass and returns [start_ms, end_ms] ranges
+    that are not part of a silent run (RMS <= silence_thresh dBFS) of at least min_silence_len ms.
+    """
+    frame_samples = max(1, frame_rate * frame_len // 1000) * channels
+    ms_per_frame = frame_samples / channels * 1000 / frame_rate
+    total_ms = int(round(len(samples) / channels * 1000 / frame_rate))
+    n_frames = len(samples) // frame_samples
+    if n_frames == 0:
+        return [[0, total_ms]] if total_ms else []
+
+    frames = samples[:n_frames * frame_samples].reshape(n_frames, frame_samples).astype(np.float32)
+    rms = np.sqrt((frames * frames).mean(axis=1))
+    # compare against the threshold as an amplitude (like pydub) instead of taking log10 per frame
+    silent = rms <= (10 ** (silence_thresh / 20.0)) * max_amplitude
+
+    # contiguous silent runs as [start, end) frame indices; keep only the long ones
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    long_runs = (run_ends - run_starts) >= int(np.ceil(min_silence_len / ms_per_frame))
+
+    ranges = []
+    prev_end = 0
+    for start, end in zip(run_starts[long_runs], run_ends[long_runs]):
+        if start > prev_end:
+            ranges.append([int(round(prev_end * ms_per_frame)), int(round(start * ms_per_frame))])
+        prev_end = end
+    if prev_end < n_frames:
+        # samples past the last whole frame belong to the trailing speech
+        ranges.append([int(round(prev_end * ms_per_frame)), total_ms])
+    return ranges
+
+
+def _split_ranges(samples: np.ndarray, frame_rate: int, max_amplitude: float, min_silence_len: int = 500,
+                  silence_thresh: float = -40, keep_silence: int = 100):
+    """
+    pydub.silence.split_on_silence over mono samples, built on _detect_nonsilent.
+    Returns the [start_ms, end_ms] range of each chunk, padded with up to keep_silence ms.
+    """
+    total_ms = len(samples) * 1000 // frame_rate
+    ranges = _detect_nonsilent(samples, frame_rate, 1, max_amplitude, min_silence_len, silence_thresh)
+    ranges = [[start - keep_silence, end + keep_silence] for start, end in ranges]
+    # same as pydub: padding of neighbouring chunks must not overlap, split the gap between them
+    for current, following in zip(ranges, ranges[1:]):
+        if following[0] < current[1]:
+            current[1] = following[0] = (current[1] + following[0]) // 2
+    return [[max(start, 0), min(end, total_ms)] for start, end in ranges]
+
+
+# default dimensions by room type (length, width, unit)
+_ROOM_DEFAULTS = MappingProxyType({
+    "kitchen": (12.0, 10.0, "feet"),
+    "bedroom": (15.0, 12.0, "feet"),
+    "living room": (16.0, 14.0, "feet"),
+    "living_room": (16.0, 14.0, "feet"),
+    "office": (12.0, 10.0, "feet"),
+    "bathroom": (8.0, 6.0, "feet"),
+    "room": (10.0, 10.0, "feet")
+})
+
+
+def _parse_number(v) -> Optional[float]:
+    """Parse int/float/string like '12', '12.5', '12 ft', return float or None."""
+    if v is None:
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, str):
+        return _parse_number_str(v)
+    return None
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_number_str(v: str) -> Optional[float]:
+    # only strings are memoized: they're hashable and the same few values ("10", "12 ft") repeat a lot
+    # find first number in the string, allow decimals
+    m = _NUM_RE.search(v)
+    if m:
+        try:
+            return float(m.group(0))
+        except ValueError:
+            return None
+    return None
+
 
 class VoiceToDWGProcessor:
-    def __init__(self, cache_max_items: int = 50, cache_max_bytes: int = 50 * 1024 * 1024):
+    # sequence for generated filenames; next() on itertools.count is atomic under the GIL
+    _file_counter = itertools.count()
+    # random per-process tag: the counter restarts at 0 and PIDs get reused (PID 1 in containers),
+    # so without it a name from before a restart could point at someone else's new drawing
+    _file_tag = secrets.token_hex(4)
+
+    def __init__(self, cache_max_items: int = 50, cache_max_bytes: int = 50 * 1024 * 1024,
+                 chunk_workers: int = 5, cache_segments: int = 1, param_cache_size: int = 256,
+                 spool_threshold: Optional[int] = None):
         self.recognizer = sr.Recognizer()
-        self.file_cache = InMemoryFileCache(max_items=cache_max_items, max_bytes=cache_max_bytes)
+        # max concurrent speech API requests per transcription (keeps us under Google STT rate limits)
+        self.chunk_workers = chunk_workers
+        # one segment by default: with the default caps, per-segment limits would be only a few files each
+        if cache_segments > 1:
+            self.file_cache = SegmentedFileCache(max_items=cache_max_items, max_bytes=cache_max_bytes,
+                                                 segments=cache_segments, on_evict=self._on_file_evicted)
+        else:
+            self.file_cache = InMemoryFileCache(max_items=cache_max_items, max_bytes=cache_max_bytes,
+                                                on_evict=self._on_file_evicted)
+        # drawings larger than this are written to a spool directory and served from disk
+        # (the cache then only holds their metadata); defaults to a tenth of the byte cap
+        self.spool_threshold = cache_max_bytes // 10 if spool_threshold is None else spool_threshold
+        self._spool_dir: Optional[str] = None
+        # prebuilt download headers per cached file, dropped together with the file
+        self._download_headers: Dict[str, Dict[str, str]] = {}
+        # LRU of Gemini results keyed on the normalized transcript hash
+        self._param_cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        # the sync extract path runs on worker threads (to_thread), so lookups and inserts can race
+        self._param_cache_lock = threading.Lock()
+        # 0 disables it
+        self._param_cache_max = param_cache_size
 
     # audio_input can be:
     # - bytes (raw file bytes, e.g. UploadFile.read())
@@ -32,30 +285,31 @@ class VoiceToDWGProcessor:
     # - a filesystem path (str)
     def transcribe_audio(self, audio_input: Union[str, bytes, io.IOBase]) -> str:
         """Convert audio to text using speech_recognition.
-        Tries WAV parsing first (no ffmpeg). Falls back to pydub.from_file (requires ffmpeg).
-        Raises HTTPException if ffmpeg is missing.
+        WAV is parsed directly (no ffmpeg). Other formats are decoded in-process with soundfile when
+        it is installed and supports them; only as a last resort does it fall back to pydub.from_file
+        (requires ffmpeg). Raises HTTPException if that fallback is needed and ffmpeg is missing.
         """
+        owned = None  # file we opened ourselves and must close
         try:
-            # Normalize input, get bytes or file-like
+            # Normalize input, get bytes or file-like.
+            # File-likes (e.g. an upload's SpooledTemporaryFile) and paths are read in place
+            # rather than copied into a BytesIO first.
             if isinstance(audio_input, (bytes, bytearray)):
                 bio = io.BytesIO(audio_input)
             elif hasattr(audio_input, "read"):
-                audio_input.seek(0)
-                bio = io.BytesIO(audio_input.read())
+                bio = audio_input
             elif isinstance(audio_input, str):
                 # path on disk
-                with open(audio_input, "rb") as f:
-                    bio = io.BytesIO(f.read())
+                bio = owned = open(audio_input, "rb")
             else:
                 raise ValueError("Unsupported audio_input type. Use bytes, file-like, or path string.")
 
             bio.seek(0)
-            transcript_parts = []
 
             # Try fast path: if data looks like WAV, use sr.AudioFile directly (no ffmpeg)
             header = bio.read(12)
             bio.seek(0)
-            is_wav = header[0:4] == b'RIFF'  # simple WAV check
+            is_wav = header[0:4] == b'RIFF' and header[8:12] == b'WAVE'
 
             if is_wav:
                 with sr.AudioFile(bio) as source:
@@ -63,28 +317,40 @@ class VoiceToDWGProcessor:
                     text = self.recognizer.recognize_google(audio_data)
                     return text.strip()
 
-            # Otherwise, try pydub.from_file (needs ffmpeg). We split on silence for better accuracy.
-            try:
-                audio = AudioSegment.from_file(bio)   # may raise FileNotFoundError if ffmpeg not installed
-            except FileNotFoundError as ff_err:
-
-                # ffmpeg is missing
-                raise HTTPException(
-                    status_code=500,
-                    detail=(
-                        "Transcription failed: 'ffmpeg' not found on the server. "
-                    )
-                ) from ff_err
-
-            chunks = split_on_silence(audio, min_silence_len=500, silence_thresh=-40)
-            for chunk in chunks:
-                buf = io.BytesIO()
-                chunk.export(buf, format="wav")
-                buf.seek(0)
-                with sr.AudioFile(buf) as source:
-                    audio_data = self.recognizer.record(source)
-                    text = self.recognizer.recognize_google(audio_data)
-                    transcript_parts.append(text)
+            decoded = _decode_soundfile(bio)
+            if decoded is not None:
+                samples, frame_rate = decoded
+            else:
+                # Otherwise, try pydub.from_file (needs ffmpeg). We split on silence for better accuracy.
+                bio.seek(0)
+                try:
+                    audio = AudioSegment.from_file(bio)   # may raise FileNotFoundError if ffmpeg not installed
+                except FileNotFoundError as ff_err:
+
+                    # ffmpeg is missing
+                    raise HTTPException(
+                        status_code=500,
+                        detail=(
+                            "Transcription failed: 'ffmpeg' not found on the server. "
+                        )
+                    ) from ff_err
+
+                # chunks go to the speech API as raw PCM, which must be mono with signed samples
+                # (sr.AudioFile used to do this conversion while parsing each chunk's WAV)
+                audio = audio.set_channels(1).set_sample_width(2)
+                samples, frame_rate = np.frombuffer(audio.raw_data, dtype=np.int16), audio.frame_rate
+
+            chunks = self._pcm_chunks(samples, frame_rate)
+
+            # each chunk is an independent network round-trip, so recognize them concurrently.
+            # pool.map keeps results in chunk order.
+            workers = max(1, min(self.chunk_workers, len(chunks)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                transcript_parts = [text for text in pool.map(self._recognize_chunk, chunks) if text]
+
+            if chunks and not transcript_parts:
+                # none of the chunks could be understood
+                raise sr.UnknownValueError()
 
             return " ".join(transcript_parts).strip()
 
@@ -96,70 +362,127 @@ class VoiceToDWGProcessor:
             raise
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Transcription failed: {str(e)}")
+        finally:
+            if owned is not None:
+                owned.close()
+
+    async def transcribe_audio_async(self, audio_input: Union[str, bytes, io.IOBase]) -> str:
+        """transcribe_audio on a worker thread, so it doesn't block the event loop."""
+        return await asyncio.to_thread(self.transcribe_audio, audio_input)
+
+    def _pcm_chunks(self, samples: np.ndarray, frame_rate: int):
+        """Split mono 16-bit samples on silence into sr.AudioData chunks for the speech API."""
+        # PCM goes straight to the recognizer; no WAV encode/parse round-trip
+        if len(samples) * 1000 // frame_rate < SHORT_AUDIO_MS:
+            # short clips fit in a single speech API request; splitting would only add round-trips
+            return [sr.AudioData(samples.tobytes(), frame_rate, 2)]
+        ranges = _split_ranges(samples, frame_rate, float(1 << 15), min_silence_len=500, silence_thresh=-40)
+        return [
+            sr.AudioData(samples[start * frame_rate // 1000:end * frame_rate // 1000].tobytes(), frame_rate, 2)
+            for start, end in ranges
+        ]
+
+    def _recognize_chunk(self, audio_data: sr.AudioData) -> str:
+        """Recognize a single silence-split chunk. Returns "" if the chunk could not be understood,
+        so one bad chunk doesn't fail the whole transcription."""
+        try:
+            return self.recognizer.recognize_google(audio_data)
+        except sr.UnknownValueError:
+            return ""
 
     def extract_drawing_parameters(self, transcript: str) -> Dict[str, Any]:
         """Use Gemini to extract structured drawing parameters from transcript"""
-        prompt = f"""
-        From this transcript: "{transcript}"
-        
-        Extract drawing parameters and return a JSON object with the following structure:
-        {{
-            "room_type": "kitchen/bedroom/living_room/office/bathroom",
-            "dimensions": {{
-                "length": number,
-                "width": number,
-                "unit": "feet/meters"
-            }},
-            "elements": [
-                {{
-                    "type": "door/window/wall/fixture",
-                    "position": "north/south/east/west/front/back/left/right",
-                    "size": {{
-                        "width": number,
-                        "height": number
-                    }}
-                }}
-            ],
-            "additional_notes": "any other specifications"
-        }}
-        
-        If dimensions or positions aren't specified, use reasonable defaults for the room type.
-        Return only the JSON object, no other text.
-        """
-        
-        try:
-            response = model.generate_content(prompt)
-            json_text = response.text.strip()
-            if json_text.startswith('```json'):
-                json_text = json_text[7:-3]
-            elif json_text.startswith('```'):
-                json_text = json_text[3:-3]
-            return json.loads(json_text)
-        except Exception:
-            # fallback
-            return self._fallback_parameter_extraction(transcript)
+        key = self._transcript_key(transcript)
+        cached = self._get_cached_parameters(key)
+        if cached is not None:
+            return cached
+
+        gen_model, prompt = self._extraction_request(transcript)
+        for attempt in range(GEMINI_ATTEMPTS):
+            try:
+                response = gen_model.generate_content(prompt, generation_config=GENERATION_CONFIG,
+                                                      request_options={'timeout': GEMINI_TIMEOUT})
+                return self._cache_parameters(key, json.loads(response.text))
+            except _RETRYABLE_GEMINI_ERRORS:
+                if attempt + 1 < GEMINI_ATTEMPTS:
+                    time.sleep(0.2 * 2 ** attempt)
+            except Exception:
+                break
+        # fallback (not cached, so the next call retries Gemini)
+        return self._fallback_parameter_extraction(transcript)
+
+    async def extract_drawing_parameters_async(self, transcript: str) -> Dict[str, Any]:
+        """Same as extract_drawing_parameters, using the Gemini SDK's native async call."""
+        key = self._transcript_key(transcript)
+        cached = self._get_cached_parameters(key)
+        if cached is not None:
+            return cached
+
+        gen_model, prompt = self._extraction_request(transcript)
+        for attempt in range(GEMINI_ATTEMPTS):
+            try:
+                response = await gen_model.generate_content_async(prompt, generation_config=GENERATION_CONFIG,
+                                                                  request_options={'timeout': GEMINI_TIMEOUT})
+                return self._cache_parameters(key, json.loads(response.text))
+            except _RETRYABLE_GEMINI_ERRORS:
+                if attempt + 1 < GEMINI_ATTEMPTS:
+                    await asyncio.sleep(0.2 * 2 ** attempt)
+            except Exception:
+                break
+        return self._fallback_parameter_extraction(transcript)
+
+    def _extraction_request(self, transcript: str):
+        """Model and prompt for an extraction call."""
+        return get_model(), f'{EXTRACTION_INSTRUCTIONS}\nTranscript: "{transcript}"'
+
+    def _get_cached_parameters(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._param_cache_lock:
+            cached = self._param_cache.get(key)
+            if cached is None:
+                return None
+            self._param_cache.move_to_end(key, last=True)
+        # callers (and generate_dwg) may mutate the result
+        return copy.deepcopy(cached)
+
+    def _cache_parameters(self, key: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        if self._param_cache_max <= 0:
+            return parameters
+        stored = copy.deepcopy(parameters)
+        with self._param_cache_lock:
+            self._param_cache[key] = stored
+            if len(self._param_cache) > self._param_cache_max:
+                self._param_cache.popitem(last=False)
+        return parameters
+
+    @staticmethod
+    def _transcript_key(transcript: str) -> str:
+        """Cache key for a transcript: case and whitespace differences map to the same entry."""
+        normalized = " ".join(transcript.lower().split())
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
 
     def _fallback_parameter_extraction(self, transcript: str) -> Dict[str, Any]:
-        dimensions = re.findall(r'(\d+)x(\d+)', transcript.lower())
-        room_types = ['kitchen', 'bedroom', 'living room', 'office', 'bathroom']
-        
+        text = transcript.lower()
+        dimensions = _DIM_RE.findall(text)
+        # one scan for every keyword we care about instead of a substring search per keyword
+        keywords = set(_KEYWORD_RE.findall(text))
+
         room_type = "room"
-        for rt in room_types:
-            if rt in transcript.lower():
+        for rt in _ROOM_TYPES:
+            if rt in keywords:
                 room_type = rt
                 break
-        
+
         length, width = (10, 10)  # Default
         if dimensions:
             length, width = int(dimensions[0][0]), int(dimensions[0][1])
         
         elements = []
-        if 'door' in transcript.lower():
+        if 'door' in keywords:
             position = 'east'
-            if 'right' in transcript.lower(): position = 'east'
-            elif 'left' in transcript.lower(): position = 'west'
-            elif 'front' in transcript.lower(): position = 'north'
-            elif 'back' in transcript.lower(): position = 'south'
+            if 'right' in keywords: position = 'east'
+            elif 'left' in keywords: position = 'west'
+            elif 'front' in keywords: position = 'north'
+            elif 'back' in keywords: position = 'south'
             
             elements.append({
                 "type": "door",
@@ -167,7 +490,7 @@ class VoiceToDWGProcessor:
                 "size": {"width": 3, "height": 7}
             })
         
-        if 'window' in transcript.lower():
+        if 'window' in keywords:
             elements.append({
                 "type": "window",
                 "position": "north",
@@ -181,38 +504,11 @@ class VoiceToDWGProcessor:
             "additional_notes": transcript
         }
 
-    def _parse_number(self, v):
-        """Parse int/float/string like '12', '12.5', '12 ft', return float or None."""
-        if v is None:
-            return None
-        if isinstance(v, (int, float)):
-            return float(v)
-        if isinstance(v, str):
-            # find first number in the string, allow decimals
-            m = re.search(r'(-?\d+(\.\d+)?)', v)
-            if m:
-                try:
-                    return float(m.group(1))
-                except:
-                    return None
-        return None
-
     def _ensure_dimensions(self, parameters: Dict[str, Any]) -> Dict[str, float]:
         """
         Ensure 'dimensions' exist and return tuple (length, width, unit).
         If missing or invalid, set reasonable defaults based on room_type.
         """
-        # defaults by room type (length, width, unit)
-        defaults = {
-            "kitchen": (12.0, 10.0, "feet"),
-            "bedroom": (15.0, 12.0, "feet"),
-            "living room": (16.0, 14.0, "feet"),
-            "living_room": (16.0, 14.0, "feet"),
-            "office": (12.0, 10.0, "feet"),
-            "bathroom": (8.0, 6.0, "feet"),
-            "room": (10.0, 10.0, "feet")
-        }
-
         room_type = (parameters.get("room_type") or "").lower() if parameters else ""
         if not room_type:
             room_type = "room"
@@ -223,12 +519,12 @@ class VoiceToDWGProcessor:
         width_raw = dims.get("width")
         unit = dims.get("unit") or "feet"
 
-        length = self._parse_number(length_raw)
-        width = self._parse_number(width_raw)
+        length = _parse_number(length_raw)
+        width = _parse_number(width_raw)
 
         if length is None or width is None:
             # fallback to defaults for detected room_type, or generic default
-            chosen = defaults.get(room_type, defaults["room"])
+            chosen = _ROOM_DEFAULTS.get(room_type, _ROOM_DEFAULTS["room"])
             if length is None:
                 length = float(chosen[0])
             if width is None:
@@ -242,10 +538,16 @@ class VoiceToDWGProcessor:
 
         return {"length": float(length), "width": float(width), "unit": str(unit)}
 
-    def generate_dwg(self, parameters: Dict[str, Any]) -> str:
+    def new_document(self):
+        """Blank DXF document for generate_dwg. Callers can build it ahead of time (e.g. while Gemini
+        is still responding) and pass it in."""
+        return ezdxf.new('R2010')
+
+    def generate_dwg(self, parameters: Dict[str, Any], doc=None) -> str:
         """
         Generate a DXF (DWG-like) file in-memory and store it in the in-memory cache.
         Validates and normalizes dimensions before drawing.
+        doc: optional blank document from new_document(); created here if not given.
         """
         try:
             # Validate / normalize dimensions (will raise HTTPException if invalid)
@@ -254,8 +556,9 @@ class VoiceToDWGProcessor:
             length = float(dims['length'])
             width = float(dims['width'])
 
-            # create dxf doc and draw
-            doc = ezdxf.new('R2010')
+            # create dxf doc (unless prepared by the caller) and draw
+            if doc is None:
+                doc = self.new_document()
             msp = doc.modelspace()
 
             points = [
@@ -268,49 +571,64 @@ class VoiceToDWGProcessor:
             msp.add_lwpolyline(points, close=True)
 
             room_label = (parameters.get('room_type') or 'Room').title()
-            msp.add_text(
-                f"{room_label}\n{length}' x {width}'",
-                dxfattribs={
-                    'height': 1,
-                    'insert': (length/2, width/2),
-                    'halign': 1,
-                    'valign': 1
-                }
-            )
-
+            texts = [{
+                'text': f"{room_label}\n{length}' x {width}'",
+                'height': 1,
+                'insert': (length/2, width/2),
+                'halign': 1,
+                'valign': 1
+            }]
+            lines, arcs = [], []
+
+            # compute geometry for every element before drawing anything, so a bad element is
+            # skipped without leaving partial entities behind; then add them one by one
             for element in parameters.get('elements', []) if parameters else []:
                 # ensure element size has numeric width to avoid None -> float error
                 try:
-                    self._add_element_to_drawing(msp, element, length, width)
+                    spec = self._element_geometry(element, length, width)
                 except Exception:
                     # skip bad element but don't crash entire generation
                     continue
+                if spec is None:
+                    continue
+                lines.extend(spec['lines'])
+                if 'arc' in spec:
+                    arcs.append(spec['arc'])
+                texts.append(spec['text'])
+
+            self._add_entities(msp, lines, arcs, texts)
 
             # produce unique filename (key)
-            file_id = str(uuid.uuid4())[:8]
+            # pid keeps names distinct across workers forked after import (they share _file_tag)
+            file_id = f"{self._file_tag}{os.getpid():x}-{next(self._file_counter):08x}"
             filename = f"drawing_{file_id}.dxf"
 
-            # write text and encode (ezdxf writes text)
-            try:
-                text_buf = io.StringIO()
-                doc.write(text_buf)
-                dxf_text = text_buf.getvalue()
-                data = dxf_text.encode('utf-8')
-            except Exception as e_text:
-                # fallback using TextIOWrapper -> BytesIO
-                try:
-                    bin_buf = io.BytesIO()
-                    text_wrapper = io.TextIOWrapper(bin_buf, encoding='utf-8', newline='')
-                    doc.write(text_wrapper)
-                    text_wrapper.flush()
-                    bin_buf.seek(0)
-                    data = bin_buf.read()
-                except Exception as e_bin:
-                    raise HTTPException(status_code=500,
-                        detail=f"Failed to export DXF to memory (text and binary attempts failed): {e_text} | {e_bin}"
-                    )
-
-            metadata = {"filename": filename, "created_at": time.time(), "size": len(data)}
+            # serialize straight to bytes as binary DXF: one pass, no intermediate str to re-encode
+            bin_buf = io.BytesIO()
+            doc.write(bin_buf, fmt='bin')
+            data = bin_buf.getvalue()
+
+            # size/created_at are recorded by the cache itself
+            metadata = {"filename": filename}
+            if len(data) > self.spool_threshold:
+                # large drawing: keep it on disk (uncompressed, so it can be sent with sendfile)
+                path = os.path.join(self._get_spool_dir(), filename)
+                with open(path, "wb") as f:
+                    f.write(data)
+                metadata.update(path=path, orig_size=len(data))
+                self.file_cache.set(filename, b"", metadata=metadata)
+                return filename
+            # even binary DXF is highly repetitive (group codes, handles, table names); store it compressed
+            # when that actually saves space so the cache's byte budget holds more drawings
+            compressed = zlib.compress(data, level=3)
+            if len(compressed) < len(data):
+                metadata.update(orig_size=len(data), compressed=True)
+                data = compressed
+            # headers go in first so that an immediate eviction by set() also drops them
+            self._download_headers[filename] = {
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "Content-Length": str(metadata.get("orig_size", len(data))),
+            }
             self.file_cache.set(filename, data, metadata=metadata)
             return filename
 
@@ -320,73 +638,126 @@ class VoiceToDWGProcessor:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"DWG generation failed: {str(e)}")
 
-    def _add_element_to_drawing(self, msp, element, room_length, room_width):
+    async def new_document_async(self):
+        return await asyncio.to_thread(self.new_document)
+
+    async def generate_dwg_async(self, parameters: Dict[str, Any], doc=None) -> str:
+        """generate_dwg on a worker thread, so it doesn't block the event loop."""
+        return await asyncio.to_thread(self.generate_dwg, parameters, doc)
+
+    def _element_geometry(self, element, room_length, room_width) -> Optional[Dict[str, Any]]:
+        """
+        Geometry for a single door/window: {'lines': [(start, end), ...], 'arc': (center, radius,
+        start_angle, end_angle) for doors, 'text': TEXT dxfattribs}. None if the element isn't drawn.
+        """
         element_type = element['type']
         position = element.get('position', 'north')
         size = element.get('size', {'width': 3, 'height': 1})
-        
+
+        style = _ELEMENT_STYLES.get(element_type)
+        if style is None:
+            return None
+        label, text_height, default_side, geometry = style
+        side = _POS_ALIAS.get(position, default_side)
+        if side is None:
+            return None
+
         room_length = float(room_length)
         room_width = float(room_width)
         element_width = float(size['width'])
-        
-        if element_type == 'door':
-            if position in ['east', 'right']:
-                door_y = room_width / 2 - element_width / 2
-                msp.add_line((room_length, door_y), (room_length, door_y + element_width))
-                msp.add_arc(
-                    center=(room_length, door_y),
-                    radius=element_width,
-                    start_angle=180,
-                    end_angle=270
-                )
-                msp.add_text("DOOR", dxfattribs={'height': 0.5, 'insert': (room_length - 1, door_y + element_width/2)})
-            elif position in ['west', 'left']:
-                door_y = room_width / 2 - element_width / 2
-                msp.add_line((0, door_y), (0, door_y + element_width))
-                msp.add_arc(center=(0, door_y + element_width), radius=element_width, start_angle=0, end_angle=90)
-                msp.add_text("DOOR", dxfattribs={'height': 0.5, 'insert': (1, door_y + element_width/2)})
-            elif position in ['north', 'front']:
-                door_x = room_length / 2 - element_width / 2
-                msp.add_line((door_x, room_width), (door_x + element_width, room_width))
-                msp.add_arc(center=(door_x, room_width), radius=element_width, start_angle=270, end_angle=360)
-                msp.add_text("DOOR", dxfattribs={'height': 0.5, 'insert': (door_x + element_width/2, room_width - 1)})
-            else:  # south/back
-                door_x = room_length / 2 - element_width / 2
-                msp.add_line((door_x, 0), (door_x + element_width, 0))
-                msp.add_arc(center=(door_x + element_width, 0), radius=element_width, start_angle=90, end_angle=180)
-                msp.add_text("DOOR", dxfattribs={'height': 0.5, 'insert': (door_x + element_width/2, 1)})
-        
-        elif element_type == 'window':
-            if position in ['north', 'front']:
-                window_x = room_length / 2 - element_width / 2
-                msp.add_line((window_x, room_width), (window_x + element_width, room_width))
-                msp.add_line((window_x, room_width - 0.2), (window_x + element_width, room_width - 0.2))
-                msp.add_text("WINDOW", dxfattribs={'height': 0.3, 'insert': (window_x + element_width/2, room_width - 0.5)})
-            elif position in ['south', 'back']:
-                window_x = room_length / 2 - element_width / 2
-                msp.add_line((window_x, 0), (window_x + element_width, 0))
-                msp.add_line((window_x, 0.2), (window_x + element_width, 0.2))
-                msp.add_text("WINDOW", dxfattribs={'height': 0.3, 'insert': (window_x + element_width/2, 0.5)})
-            elif position in ['east', 'right']:
-                window_y = room_width / 2 - element_width / 2
-                msp.add_line((room_length, window_y), (room_length, window_y + element_width))
-                msp.add_line((room_length - 0.2, window_y), (room_length - 0.2, window_y + element_width))
-                msp.add_text("WINDOW", dxfattribs={'height': 0.3, 'insert': (room_length - 0.5, window_y + element_width/2), 'rotation': 90})
-            elif position in ['west', 'left']:
-                window_y = room_width / 2 - element_width / 2
-                msp.add_line((0, window_y), (0, window_y + element_width))
-                msp.add_line((0.2, window_y), (0.2, window_y + element_width))
-                msp.add_text("WINDOW", dxfattribs={'height': 0.3, 'insert': (0.5, window_y + element_width/2), 'rotation': 90})
+
+        # element is centered on its wall: start, end and middle of its span along that wall
+        wall_length = room_length if side in ('N', 'S') else room_width
+        start = wall_length / 2 - element_width / 2
+        spec = geometry[side](room_length, room_width, start, start + element_width, start + element_width / 2)
+
+        text = {'text': label, 'height': text_height, 'insert': spec.pop('text')}
+        if 'rotation' in spec:
+            text['rotation'] = spec.pop('rotation')
+        spec['text'] = text
+        if 'arc' in spec:
+            center, start_angle, end_angle = spec['arc']
+            spec['arc'] = (center, element_width, start_angle, end_angle)
+        return spec
+
+    def _add_entities(self, msp, lines, arcs, texts):
+        """Add the precomputed LINE/ARC/TEXT entities to the modelspace, one add_* call each."""
+        for start, end in lines:
+            msp.add_line(start, end)
+        for center, radius, start_angle, end_angle in arcs:
+            msp.add_arc(center=center, radius=radius, start_angle=start_angle, end_angle=end_angle)
+        for text in texts:
+            msp.add_text(text['text'], dxfattribs={k: v for k, v in text.items() if k != 'text'})
 
     # retrieval helpers
+    def _get_spool_dir(self) -> str:
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.mkdtemp(prefix="voice-to-dwg-")
+            atexit.register(shutil.rmtree, self._spool_dir, True)
+        return self._spool_dir
+
+    def get_file_path(self, filename: str) -> Optional[str]:
+        """Path of a drawing that was spooled to disk, or None if it is held in memory (or missing)."""
+        metadata = self.file_cache.get_metadata(filename)
+        if not metadata or "path" not in metadata:
+            return None
+        # a download counts as a use for LRU purposes
+        self.file_cache.get(filename)
+        return metadata["path"]
+
     def get_file_bytes(self, filename: str) -> Optional[bytes]:
-        return self.file_cache.get(filename)
+        # metadata first: if the entry is evicted in between we report a miss rather than
+        # returning compressed bytes as DXF
+        metadata = self.file_cache.get_metadata(filename)
+        data = self.file_cache.get(filename)
+        if data is None or metadata is None:
+            return None
+        if "path" in metadata:
+            try:
+                with open(metadata["path"], "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+        return zlib.decompress(data) if metadata.get("compressed") else data
+
+    def get_download(self, filename: str) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        """File bytes plus the response headers built for it at generation time."""
+        headers = self._download_headers.get(filename)
+        data = self.get_file_bytes(filename)
+        if data is None:
+            return None
+        if headers is None:
+            # cold path: cached before headers were recorded
+            headers = {"Content-Disposition": f'attachment; filename="{filename}"',
+                       "Content-Length": str(len(data))}
+        return data, headers
 
     def get_file_metadata(self, filename: str) -> Optional[Dict]:
         return self.file_cache.get_metadata(filename)
 
-    def list_files(self):
-        return self.file_cache.list_keys()
+    def cache_stats(self) -> Dict[str, int]:
+        return self.file_cache.stats()
+
+    def list_files(self, limit: Optional[int] = None):
+        return self.file_cache.list_keys(limit)
 
     def delete_file(self, filename: str) -> bool:
-        return self.file_cache.delete(filename)
\ No newline at end of file
+        self._download_headers.pop(filename, None)
+        metadata = self.file_cache.get_metadata(filename)
+        ok = self.file_cache.delete(filename)
+        if ok and metadata:
+            self._remove_spooled(metadata)
+        return ok
+
+    def _on_file_evicted(self, filename: str, data: bytes, metadata: Dict):
+        self._download_headers.pop(filename, None)
+        self._remove_spooled(metadata)
+
+    @staticmethod
+    def _remove_spooled(metadata: Dict):
+        path = metadata.get("path")
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
\ No newline at end of file
@@ -1,60 +1,202 @@
-from typing import OrderedDict, Optional, Dict
+from typing import OrderedDict, Optional, Dict, Callable, Tuple
+from itertools import islice
+import heapq
+import threading
 import time
 
+# approximate Python-side cost of one entry on top of its payload: key string, Entry object,
+# bytes object header and the OrderedDict slot/link (measured with sys.getsizeof, rounded up)
+_PYOBJ_OVERHEAD = 300
+
+# One cache entry; the size is weighed once on insertion and kept alongside the value
+class Entry:
+    __slots__ = ("data", "size", "weight", "created_ns", "extra")
+
+    def __init__(self, data: bytes, size: int, created_ns: int, extra: Optional[Dict] = None):
+        self.data = data
+        self.size = size
+        self.weight = size + _PYOBJ_OVERHEAD  # what counts against max_bytes
+        self.created_ns = created_ns  # time.monotonic_ns(): immune to wall-clock adjustments
+        self.extra = extra  # caller-supplied metadata, None when not given
+
 # In-memory LRU cache for files
 class InMemoryFileCache:
-    def __init__(self, max_items: int = 50, max_bytes: int = 50 * 1024 * 1024):
+    def __init__(self, max_items: int = 50, max_bytes: int = 50 * 1024 * 1024,
+                 on_evict: Optional[Callable[[str, bytes, Dict], None]] = None):
         """
         max_items: max number of files to keep
-        max_bytes: total bytes cap for all cached files
+        max_bytes: total bytes cap for all cached files, including a fixed per-entry overhead
+        on_evict: optional callback(key, data, metadata), called for each entry evicted to make room
         """
         self.max_items = max_items
         self.max_bytes = max_bytes
         self.current_bytes = 0
-        self._cache = OrderedDict()  # key -> (bytes, metadata)
+        self.on_evict = on_evict
+        self.hits = self.misses = self.evictions = 0
+        self._cache = OrderedDict()  # key -> Entry
+        # most-recent-first keys, memoized for list_keys until the next change in order
+        self._keys_cache: Optional[Tuple[str, ...]] = None
+        # generate_dwg runs on worker threads while downloads read on the event loop, and even
+        # get() reorders the dict, so every operation takes the lock. Re-entrant so that an
+        # on_evict callback (run while the lock is held) may call back into the cache.
+        self._lock = threading.RLock()
 
     def set(self, key: str, data: bytes, metadata: Optional[Dict] = None):
-        if key in self._cache:
-            old_bytes = len(self._cache[key][0])
-            self.current_bytes -= old_bytes
-            del self._cache[key]
-        self._cache[key] = (data, metadata or {"created_at": time.time(), "size": len(data)})
-        self.current_bytes += len(data)
-        self._cache.move_to_end(key, last=True)
-        self._evict_if_needed()
+        size = len(data)
+        entry = Entry(data, size, time.monotonic_ns(), metadata)
+        with self._lock:
+            # single lookup to drop any previous entry (instead of `in` + index + del)
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.weight
+            self._cache[key] = entry
+            self.current_bytes += entry.weight
+            self._keys_cache = None
+            # no move_to_end needed: the key was popped above, so assignment appends it as most recent
+            self._evict_if_needed()
 
     def get(self, key: str) -> Optional[bytes]:
-        entry = self._cache.get(key)
-        if not entry:
-            return None
-        
-        # touch to mark as recently used
-        self._cache.move_to_end(key, last=True)
-        return entry[0]
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+            # touch to mark as recently used, unless it already is the most recent entry
+            # (the common case when the same file is fetched repeatedly)
+            if next(reversed(self._cache)) != key:
+                self._cache.move_to_end(key, last=True)
+                self._keys_cache = None
+            return entry.data
 
     def get_metadata(self, key: str) -> Optional[Dict]:
-        entry = self._cache.get(key)
+        # peek: reading metadata doesn't count as a use, so recency is left untouched
+        with self._lock:
+            entry = self._cache.get(key)
         if not entry:
             return None
-        return entry[1]
+        return self._metadata(entry)
 
-    def list_keys(self):
-        # return most-recent-first
-        return list(reversed(self._cache.keys()))
+    def list_keys(self, limit: Optional[int] = None) -> Tuple[str, ...]:
+        # return most-recent-first, stopping after `limit` keys.
+        # The keys are copied out under the lock: a lazy view would break if another thread
+        # mutated the dict while the caller was still iterating.
+        with self._lock:
+            if self._keys_cache is None:
+                if limit is not None:
+                    # partial listing: walk only the first `limit` keys, don't memoize
+                    return tuple(islice(reversed(self._cache), limit))
+                self._keys_cache = tuple(reversed(self._cache))
+            return self._keys_cache if limit is None else self._keys_cache[:limit]
+
+    def stats(self) -> Dict[str, int]:
+        # frequent evictions mean the caps are too small for the workload
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "current_bytes": self.current_bytes, "size": len(self._cache)}
 
     def delete(self, key: str):
-        entry = self._cache.pop(key, None)
-        if entry:
-            self.current_bytes -= len(entry[0])
-            return True
-        return False
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry:
+                self.current_bytes -= entry.weight
+                self._keys_cache = None
+                return True
+            return False
 
     def clear(self):
-        self._cache.clear()
-        self.current_bytes = 0
+        with self._lock:
+            self._cache.clear()
+            self.current_bytes = 0
+            self._keys_cache = None
 
     def _evict_if_needed(self):
-        while (len(self._cache) > self.max_items) or (self.current_bytes > self.max_bytes):
-            # pop least-recently-used (first item)
-            _, (data, _) = self._cache.popitem(last=False)
-            self.current_bytes -= len(data)
\ No newline at end of file
+        # caller holds self._lock
+        # item cap first: the number to drop is known up front, so no per-iteration length check
+        for _ in range(len(self._cache) - self.max_items):
+            self._pop_lru()
+        # then the byte budget
+        while self.current_bytes > self.max_bytes and self._cache:
+            self._pop_lru()
+
+    def _pop_lru(self):
+        # pop least-recently-used (first item)
+        key, entry = self._cache.popitem(last=False)
+        self.current_bytes -= entry.weight
+        self._keys_cache = None
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, entry.data, self._metadata(entry))
+
+    @staticmethod
+    def _metadata(entry: Entry) -> Dict:
+        # built on demand; caller-supplied keys are layered over the stored size/created_at.
+        # created_at stays a wall-clock timestamp for display, derived from the entry's age
+        created_at = time.time() - (time.monotonic_ns() - entry.created_ns) / 1e9
+        meta = {"created_at": created_at, "size": entry.size}
+        if entry.extra:
+            meta.update(entry.extra)
+        return meta
+
+# Same interface as InMemoryFileCache, but the key space is split across independent segments
+# (each with its own LRU order and lock) so concurrent requests on different keys don't contend
+class SegmentedFileCache:
+    def __init__(self, max_items: int = 50, max_bytes: int = 50 * 1024 * 1024, segments: int = 16,
+                 on_evict: Optional[Callable[[str, bytes, Dict], None]] = None):
+        """
+        max_items / max_bytes: overall caps, split evenly between segments
+        segments: number of independent segments; keys are routed by hash(key) % segments
+        on_evict: passed through to every segment
+        Eviction is per segment, so an entry can be evicted while other segments still have room.
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._segments = [
+            InMemoryFileCache(max_items=max(1, max_items // segments),
+                              max_bytes=max(1, max_bytes // segments),
+                              on_evict=on_evict)
+            for _ in range(segments)
+        ]
+
+    def _segment(self, key: str) -> InMemoryFileCache:
+        return self._segments[hash(key) % len(self._segments)]
+
+    @property
+    def current_bytes(self) -> int:
+        return sum(seg.current_bytes for seg in self._segments)
+
+    def set(self, key: str, data: bytes, metadata: Optional[Dict] = None):
+        self._segment(key).set(key, data, metadata)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._segment(key).get(key)
+
+    def get_metadata(self, key: str) -> Optional[Dict]:
+        return self._segment(key).get_metadata(key)
+
+    def list_keys(self, limit: Optional[int] = None) -> Tuple[str, ...]:
+        # segments don't share a recency order, so merge them newest-created first
+        items = []
+        for seg in self._segments:
+            with seg._lock:
+                items.extend((entry.created_ns, key) for key, entry in seg._cache.items())
+        if limit is not None:
+            return tuple(key for _, key in heapq.nlargest(limit, items))
+        items.sort(reverse=True)
+        return tuple(key for _, key in items)
+
+    def stats(self) -> Dict[str, int]:
+        # summed over segments
+        totals: Dict[str, int] = {}
+        for seg in self._segments:
+            for name, value in seg.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def delete(self, key: str):
+        return self._segment(key).delete(key)
+
+    def clear(self):
+        for seg in self._segments:
+            seg.clear()
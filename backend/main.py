@@ -1,11 +1,12 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-import io
-from typing import Dict
+from fastapi.responses import ORJSONResponse, FileResponse
+import asyncio
+from typing import Dict, Optional
 from dwg_processor import VoiceToDWGProcessor
 
-app = FastAPI(title="Voice-to-DWG API")
+# orjson encodes response dicts straight to bytes in C, faster than the stdlib json default
+app = FastAPI(title="Voice-to-DWG API", default_response_class=ORJSONResponse)
 
 # Enable CORS for Streamlit
 app.add_middleware(
@@ -24,8 +25,9 @@ processor = VoiceToDWGProcessor(cache_max_items=50, cache_max_bytes=50 * 1024 *
 async def transcribe_audio(audio_file: UploadFile = File(...)):
     """Endpoint to transcribe audio file"""
     try:
-        audio_bytes = await audio_file.read()
-        transcript = processor.transcribe_audio(audio_bytes)
+        # hand over the spooled upload itself instead of reading it all into memory
+        audio_file.file.seek(0)
+        transcript = await processor.transcribe_audio_async(audio_file.file)
         return {"transcript": transcript}
     except HTTPException as e:
         raise e
@@ -39,7 +41,7 @@ async def extract_parameters(data: Dict):
     transcript = data.get("transcript", "")
     if not transcript:
         raise HTTPException(status_code=400, detail="No transcript provided")
-    parameters = processor.extract_drawing_parameters(transcript)
+    parameters = await processor.extract_drawing_parameters_async(transcript)
     return {"parameters": parameters}
 
 
@@ -49,31 +51,40 @@ async def generate_dwg(data: Dict):
     parameters = data.get("parameters", {})
     if not parameters:
         raise HTTPException(status_code=400, detail="No parameters provided")
-    filename = processor.generate_dwg(parameters)
+    filename = await processor.generate_dwg_async(parameters)
     return {"dwg_filename": filename, "download_url": f"/download-dwg/{filename}"}
 
 
 @app.get("/download-dwg/{filename}")
 async def download_dwg(filename: str):
-    """Stream DXF file from in-memory cache"""
-    data = processor.get_file_bytes(filename)
-    if not data:
+    """Serve DXF file from in-memory cache, or from disk for large spooled drawings"""
+    path = processor.get_file_path(filename)
+    if path:
+        # FileResponse streams from disk (sendfile where available) without loading it into memory
+        return FileResponse(path, media_type="application/dxf", filename=filename)
+    found = processor.get_download(filename)
+    if not found:
         raise HTTPException(status_code=404, detail="File not found")
-    buf = io.BytesIO(data)
-    buf.seek(0)
-    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
-    return StreamingResponse(buf, media_type="application/dxf", headers=headers)
+    # the payload is already fully in memory: send it in one go instead of iterating a BytesIO copy
+    data, headers = found
+    return Response(content=data, media_type="application/dxf", headers=headers)
 
 
 # Helper
 @app.get("/list-dwgs")
-def list_dwgs():
-    """List cached DWG filenames (most recent first)."""
-    return {"files": processor.list_files()}
+async def list_dwgs(limit: Optional[int] = Query(None, ge=0)):
+    """List cached DWG filenames (most recent first), optionally only the first `limit`."""
+    return {"files": processor.list_files(limit)}
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss/eviction counters and current size of the DXF cache."""
+    return processor.cache_stats()
 
 
 @app.delete("/delete-dwg/{filename}")
-def delete_dwg(filename: str):
+async def delete_dwg(filename: str):
     ok = processor.delete_file(filename)
     if not ok:
         raise HTTPException(status_code=404, detail="File not found")
@@ -84,10 +95,19 @@ def delete_dwg(filename: str):
 async def voice_to_dwg_complete(audio_file: UploadFile = File(...)):
     """voice -> transcript -> parameters -> DWG"""
     try:
-        audio_bytes = await audio_file.read()
-        transcript = processor.transcribe_audio(audio_bytes)
-        parameters = processor.extract_drawing_parameters(transcript)
-        filename = processor.generate_dwg(parameters)
+        audio_file.file.seek(0)
+        # prepare the blank DXF document while transcription and Gemini are in flight
+        doc_task = asyncio.create_task(processor.new_document_async())
+        try:
+            transcript = await processor.transcribe_audio_async(audio_file.file)
+            parameters = await processor.extract_drawing_parameters_async(transcript)
+            filename = await processor.generate_dwg_async(parameters, doc=await doc_task)
+        finally:
+            # if an earlier step failed, don't leave the task orphaned
+            # (and mark any exception it raised as retrieved)
+            doc_task.cancel()
+            if doc_task.done() and not doc_task.cancelled():
+                doc_task.exception()
         return {
             "transcript": transcript,
             "parameters": parameters,
@@ -101,5 +121,10 @@ async def voice_to_dwg_complete(audio_file: UploadFile = File(...)):
 
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # pin the C-backed loop and HTTP parser instead of relying on uvicorn's auto-detection
+    # (uvloop has no Windows build). Single worker on purpose: the DXF cache lives in this
+    # process, so a download routed to another worker would miss the file it just generated.
+    uvicorn.run(app, host="0.0.0.0", port=8000,
+                loop="asyncio" if sys.platform == "win32" else "uvloop", http="httptools")
\ No newline at end of file
@@ -1,6 +1,6 @@
 import streamlit as st
 import requests
-import io
+from requests.adapters import HTTPAdapter
 import os
 from dotenv import load_dotenv
 from audio_recorder_streamlit import audio_recorder
@@ -17,6 +17,18 @@ st.set_page_config(
 # FastAPI backend URL
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+@st.cache_resource
+def get_session():
+    """One pooled HTTP session for all backend calls.
+    Streamlit re-runs this script on every interaction, so a plain module-level Session would be
+    rebuilt (and its connections dropped) each time; cache_resource keeps it alive across reruns.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 def main():
     st.title("🎤 Voice-to-DWG Conversational Design Assistant 🎤")
     st.markdown("---")
@@ -96,32 +108,20 @@ def process_voice_command(audio_bytes, uploaded_file, backend_url):
         try:
             files = None
 
+            # requests accepts raw bytes in the files tuple, so no BytesIO wrapper (or copy) is needed
             if audio_bytes:
-                # audio_bytes is raw bytes from audio_recorder. Wrap in BytesIO and give a filename.
-                buf = io.BytesIO(audio_bytes)
-                buf.seek(0)
-                # choose a sensible filename and mime
-                files = {'audio_file': ('recording.wav', buf, 'audio/wav')}
+                # audio_bytes is raw bytes from audio_recorder; give it a sensible filename and mime
+                files = {'audio_file': ('recording.wav', audio_bytes, 'audio/wav')}
             elif uploaded_file:
-                # read uploaded file bytes
-                file_bytes = uploaded_file.read()
-                buf = io.BytesIO(file_bytes)
-                buf.seek(0)
+                # uploaded file bytes
                 mime = uploaded_file.type or 'application/octet-stream'
-                files = {'audio_file': (uploaded_file.name, buf, mime)}
+                files = {'audio_file': (uploaded_file.name, uploaded_file.getvalue(), mime)}
             else:
                 st.error("No audio file provided")
                 return
 
             # POST to backend
-            try:
-                resp = requests.post(f"{backend_url.rstrip('/')}/voice-to-dwg", files=files, timeout=120)
-            finally:
-                # Close bytes buffer to free memory
-                try:
-                    buf.close()
-                except Exception:
-                    pass
+            resp = get_session().post(f"{backend_url.rstrip('/')}/voice-to-dwg", files=files, timeout=120)
 
             if resp.status_code == 200:
                 result = resp.json()
@@ -147,7 +147,7 @@ def download_dwg_file(dwg_filename, backend_url):
     """Download the generated DWG file from backend cache and present download button."""
     try:
         download_url = f"{backend_url.rstrip('/')}/download-dwg/{dwg_filename}"
-        resp = requests.get(download_url, timeout=60)
+        resp = get_session().get(download_url, timeout=60)
         if resp.status_code == 200:
             # use the filename returned or a default name
             download_name = f"{dwg_filename}" if dwg_filename else "voice_generated_drawing.dxf"